@@ -22,6 +22,7 @@
 #if defined(__unix__) || defined(__APPLE__)
 #include <unistd.h>
 #include <sys/socket.h>
+#include <sys/stat.h>
 #include <sys/un.h>
 #define HAVE_UNIX_SOCKETS 1
 #else
@@ -43,7 +44,6 @@
 #endif
 
 #define DB_PATH "commands.db"
-#define SUGGEST_SOCKET_PATH "/tmp/shell_suggest.sock"
 #define MAXLINE 4096
 #define MAXARGS 256
 /* TCP fallback for suggestion server (matches suggestion server default) */
@@ -198,17 +198,37 @@ char *get_suggestion_tcp(const char *line_prefix, const char *model, int timeout
     return ret;
 }
 
+#if HAVE_UNIX_SOCKETS
+/* Same default as suggestion_protocol.py: $SUGGEST_SOCKET_PATH, else $XDG_RUNTIME_DIR,
+ * else a per-user directory under /tmp */
+static void suggest_socket_path(char *out, size_t n) {
+    const char *env = getenv("SUGGEST_SOCKET_PATH");
+    if (env && *env) { snprintf(out, n, "%s", env); return; }
+    env = getenv("XDG_RUNTIME_DIR");
+    if (env && *env) { snprintf(out, n, "%s/shell_suggest.sock", env); return; }
+    snprintf(out, n, "/tmp/shell_suggest-%u/shell_suggest.sock", (unsigned)getuid());
+}
+
+/* Only send keystrokes to a socket the current user owns */
+static int own_socket(const char *path) {
+    struct stat st;
+    return lstat(path, &st) == 0 && S_ISSOCK(st.st_mode) && st.st_uid == getuid();
+}
+#endif
+
 char *get_suggestion(const char *line_prefix, const char *model, int timeout_ms) {
     if (!line_prefix || strlen(line_prefix) == 0) return NULL;
 #if HAVE_UNIX_SOCKETS
     /* Prefer Unix domain socket when available (existing behavior) */
     int sock = -1;
     struct sockaddr_un addr;
-    sock = socket(AF_UNIX, SOCK_STREAM, 0);
+    char sock_path[sizeof(addr.sun_path)];
+    suggest_socket_path(sock_path, sizeof(sock_path));
+    sock = own_socket(sock_path) ? socket(AF_UNIX, SOCK_STREAM, 0) : -1;
     if (sock >= 0) {
         memset(&addr, 0, sizeof(addr));
         addr.sun_family = AF_UNIX;
-        strncpy(addr.sun_path, SUGGEST_SOCKET_PATH, sizeof(addr.sun_path)-1);
+        strncpy(addr.sun_path, sock_path, sizeof(addr.sun_path)-1);
         if (connect(sock, (struct sockaddr*)&addr, sizeof(addr)) == 0) {
             char buf[MAXLINE];
             char payload[MAXLINE];
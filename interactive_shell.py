@@ -1,13 +1,16 @@
-import socket, json
+import socket
 from prompt_toolkit import PromptSession
 from prompt_toolkit.completion import Completer, Completion
 
+from suggestion_protocol import json_dumps, json_loads
+
 # Connect to suggestion server
 def get_suggestions(prefix):
     try:
         s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
         s.connect(("localhost", 8888))
-        s.sendall((json.dumps({"cmd": prefix}) + "\n").encode())
+        s.sendall(json_dumps({"cmd": prefix}) + b"\n")
 
         data = b""
         while True:
@@ -19,7 +22,7 @@ def get_suggestions(prefix):
                 break
 
         s.close()
-        suggestions = json.loads(data.decode().strip())
+        suggestions = json_loads(data)
         return suggestions
 
     except Exception as e:
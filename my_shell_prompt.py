@@ -4,16 +4,21 @@ from prompt_toolkit.document import Document
 from prompt_toolkit.patch_stdout import patch_stdout
 import threading
 import time
-import queue
+from collections import OrderedDict, deque
 
 from suggestion_client import get_suggestions
 
-# Debounce interval (seconds) before sending prefix to server
+# Initial debounce interval (seconds) before sending prefix to server; the worker then
+# adapts it to half the measured round-trip time, clamped to [MIN_DEBOUNCE, MAX_DEBOUNCE]
 DEBOUNCE = 0.15
+MIN_DEBOUNCE = 0.03
+MAX_DEBOUNCE = 0.2
 # Suggestion fetch timeout (seconds)
 FETCH_TIMEOUT = 0.5
 # Default model name to request from server
 DEFAULT_MODEL = "Claude Haiku 4.5"
+# The server returns at most this many suggestions per query
+SERVER_MAX_SUGGESTIONS = 5
 
 class SharedSuggestions:
     def __init__(self):
@@ -31,6 +36,41 @@ class SharedSuggestions:
             return self.last_query, list(self.suggestions)
 
 
+class PrefixCache:
+    """LRU map of queried text -> server suggestions.
+
+    Lets keystrokes that extend an earlier query be answered locally.
+    """
+    def __init__(self, capacity=256):
+        self.capacity = capacity
+        self.entries = OrderedDict()
+
+    def put(self, query, suggestions):
+        self.entries[query] = suggestions
+        self.entries.move_to_end(query)
+        if len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+
+    def lookup(self, text):
+        """Return suggestions for text from the longest cached prefix, or None to ask the server."""
+        for end in range(len(text), 0, -1):
+            key = text[:end]
+            suggs = self.entries.get(key)
+            if suggs is None:
+                continue
+            self.entries.move_to_end(key)
+            if key == text:
+                return list(suggs)
+            # a capped reply may have cut off the best matches for the longer text
+            if len(suggs) >= SERVER_MAX_SUGGESTIONS:
+                return None
+            lowered = text.lower()
+            return [it for it in suggs
+                    if it.get("suggestion", "").lower().startswith(lowered)
+                    and it.get("suggestion", "").lower() != lowered]
+        return None
+
+
 class LiveCompleter(Completer):
     def __init__(self, shared: SharedSuggestions):
         self.shared = shared
@@ -55,39 +95,62 @@ class LiveCompleter(Completer):
                 )
 
 
-def suggestion_worker(input_q: "queue.Queue[str]", shared: SharedSuggestions, stop_event: threading.Event):
-    """Background worker that consumes latest text, waits for debounce, queries server and updates shared suggestions."""
+def suggestion_worker(input_q: "deque[str]", new_input: threading.Event, shared: SharedSuggestions, stop_event: threading.Event):
+    """Background worker that consumes latest text, waits for debounce, queries server and updates shared suggestions.
+
+    input_q has maxlen=1, so it only ever holds the latest text; new_input is set whenever it changes.
+    """
     last = None
+    cache = PrefixCache()
+    # exponential moving average of server round-trip time, seeded so the first debounce is DEBOUNCE
+    ema_rtt = 2 * DEBOUNCE
+    debounce = DEBOUNCE
     while not stop_event.is_set():
+        # Wait for new text (block short time so we can check stop_event)
+        if not new_input.wait(timeout=0.05):
+            continue
+        new_input.clear()
         try:
-            # Wait for new text (block short time so we can check stop_event)
-            val = input_q.get(timeout=0.05)
-            last = val
-            # consume any additional queued updates so we only process the latest
-            while True:
-                try:
-                    last = input_q.get_nowait()
-                except queue.Empty:
-                    break
-            # debounce: wait a short interval to allow user to keep typing
-            t0 = time.time()
-            while time.time() - t0 < DEBOUNCE:
+            last = input_q.pop()
+        except IndexError:
+            continue
+        try:
+            # debounce: wait a short interval to allow user to keep typing;
+            # if new input arrives, reset debounce and use latest
+            while new_input.wait(timeout=debounce):
+                new_input.clear()
                 try:
-                    # if new input arrives, reset debounce and use latest
-                    last = input_q.get(timeout=DEBOUNCE - (time.time() - t0))
-                    t0 = time.time()
-                except queue.Empty:
-                    break
+                    last = input_q.pop()
+                except IndexError:
+                    pass
             # If last is empty or whitespace, clear suggestions
             if not last or last.strip() == "":
                 shared.update(last, [])
                 continue
+            # Text extending an earlier query can often be answered from the cache
+            cached = cache.lookup(last)
+            if cached:
+                shared.update(last, cached)
+                continue
             # Query suggestion server (may block up to FETCH_TIMEOUT)
+            t0 = time.perf_counter()
             suggs = get_suggestions(last, model=DEFAULT_MODEL, timeout=FETCH_TIMEOUT)
+            ema_rtt = 0.9 * ema_rtt + 0.1 * (time.perf_counter() - t0)
+            debounce = max(MIN_DEBOUNCE, min(MAX_DEBOUNCE, 0.5 * ema_rtt))
+            query = last
             # If returned object is dict with suggestions key, normalize (handled in client)
-            shared.update(last, suggs if isinstance(suggs, list) else [])
-        except queue.Empty:
-            continue
+            suggs = suggs if isinstance(suggs, list) else []
+            cache.put(query, suggs)
+            # Typing may have continued while the request was in flight. The reply is
+            # still useful if the current text extends the query it answered, so
+            # publish it filtered to the current text instead of dropping it.
+            current = input_q[-1] if input_q else query
+            if current == query:
+                shared.update(query, suggs)
+            elif current.startswith(query):
+                filtered = cache.lookup(current)
+                if filtered:
+                    shared.update(current, filtered)
         except Exception:
             # On any error, ensure shared updated to empty to avoid stale suggestions
             shared.update(last if last else "", [])
@@ -98,38 +161,27 @@ def main_loop():
     shared = SharedSuggestions()
     comp = LiveCompleter(shared)
 
-    # Queue of prefix updates from prompt buffer
-    input_q = queue.Queue()
+    # Latest prefix from prompt buffer, plus a flag raised on every change
+    input_q = deque(maxlen=1)
+    new_input = threading.Event()
     stop_event = threading.Event()
-    worker = threading.Thread(target=suggestion_worker, args=(input_q, shared, stop_event), daemon=True)
+    worker = threading.Thread(target=suggestion_worker, args=(input_q, new_input, shared, stop_event), daemon=True)
     worker.start()
 
-    try:
-        while True:
-            # Use a small wrapper to push buffer text to fetcher while typing
-            def on_text_changed(buf):
-                # push current text to queue (non-blocking)
-                try:
-                    input_q.put_nowait(buf.text)
-                except queue.Full:
-                    pass
+    # Push buffer text to fetcher while typing; prompt_toolkit passes the changed buffer
+    def on_text_changed(buf):
+        # replace any pending text with the current one (non-blocking)
+        input_q.append(buf.text)
+        new_input.set()
 
-            buf = session.default_buffer
-            # attach handler
-            handler = buf.on_text_changed
-            # register callback
-            cb = lambda _: on_text_changed(buf)
-            buf.on_text_changed += cb
+    # Every prompt() reuses session.default_buffer, so register the handler once
+    session.default_buffer.on_text_changed += on_text_changed
 
+    try:
+        while True:
             with patch_stdout():
                 text = session.prompt("myOS> ", completer=comp, complete_while_typing=True, enable_history_search=False)
 
-            # detach handler
-            try:
-                buf.on_text_changed -= cb
-            except Exception:
-                pass
-
             if text.strip().lower() == "exit":
                 print("Exiting myOS shell.")
                 break
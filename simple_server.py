@@ -5,12 +5,21 @@ Listens on 127.0.0.1:8888 and returns a JSON object:
   {"model":"Claude Haiku 4.5","suggestions":[{...}, ...]}
 This lets you test the UI and IPC without installing heavy Python packages.
 """
+import asyncio
+import logging
+import os
 import socket
-import threading
-import json
+
+from suggestion_protocol import json_dumps, json_loads, default_socket_path, serve_connection, serve_forever
+
+# Per-request lines are DEBUG; set SUGGEST_LOG_LEVEL=DEBUG to see them
+logging.basicConfig(level=os.environ.get('SUGGEST_LOG_LEVEL', 'INFO').upper(), format='%(message)s')
+log = logging.getLogger('simple_server')
 
 HOST = '127.0.0.1'
 PORT = 9999
+# Also served where AF_UNIX exists; same default path as suggestion_server and core.c
+SOCK_PATH = default_socket_path() if hasattr(socket, 'AF_UNIX') else None
 
 SAMPLE_TEMPLATES = [
     'git status',
@@ -22,6 +31,7 @@ SAMPLE_TEMPLATES = [
     'pip install -r requirements.txt',
     'npm install',
 ]
+SAMPLE_TEMPLATES_LOWER = [t.lower() for t in SAMPLE_TEMPLATES]
 
 
 def make_suggestions(q):
@@ -30,8 +40,8 @@ def make_suggestions(q):
     if ql == '':
         return items
     # partial matches from templates
-    for t in SAMPLE_TEMPLATES:
-        if ql in t.lower():
+    for t, low in zip(SAMPLE_TEMPLATES, SAMPLE_TEMPLATES_LOWER):
+        if ql in low:
             items.append({
                 'source': 'Template',
                 'suggestion': t,
@@ -49,67 +59,46 @@ def make_suggestions(q):
     return items
 
 
-def handle_conn(conn, addr):
+def handle_request(raw, addr):
+    """Answer one request payload and return the encoded JSON response body."""
+    log.debug("[%s] received: %s", addr, raw)
+    query = raw
+    model = 'Claude Haiku 4.5'
     try:
-        conn.settimeout(1.0)
-        data = b''
-        try:
-            while True:
-                chunk = conn.recv(4096)
-                if not chunk:
-                    break
-                data += chunk
-                if b"\n" in data:
-                    break
-        except socket.timeout:
-            pass
-
-        if not data:
-            print(f"[{addr}] no data received")
-            return
-
-        raw = data.decode().strip()
-        print(f"[{addr}] received: {raw}")
-        query = raw
-        model = 'Claude Haiku 4.5'
-        try:
-            obj = json.loads(raw)
-            if isinstance(obj, dict):
-                query = obj.get('cmd', raw)
-                model = obj.get('model', model)
-        except Exception:
-            # not JSON, keep raw
-            pass
-
-        suggestions = make_suggestions(query)
-        payload = {'model': model, 'suggestions': suggestions}
-        resp = (json.dumps(payload) + '\n').encode()
-        conn.sendall(resp)
-        print(f"[{addr}] sent {len(suggestions)} suggestions (model={model})")
-    except Exception as e:
-        print(f"[{addr}] error: {e}")
-    finally:
-        try:
-            conn.close()
-        except:
-            pass
+        obj = json_loads(raw)
+        if isinstance(obj, dict):
+            query = obj.get('cmd', raw)
+            model = obj.get('model', model)
+    except Exception:
+        # not JSON, keep raw
+        pass
+
+    suggestions = make_suggestions(query)
+    payload = {'model': model, 'suggestions': suggestions}
+    log.debug("[%s] sent %d suggestions (model=%s)", addr, len(suggestions), model)
+    return json_dumps(payload)
+
+
+async def handle_client(reader, writer):
+    """Serve framed (or legacy newline-terminated) requests from one client."""
+    addr = writer.get_extra_info('peername')
+
+    async def answer(raw):
+        return handle_request(raw, addr)
+
+    await serve_connection(reader, writer, answer, log)
+
+
+async def serve():
+    await serve_forever(handle_client, HOST, PORT, SOCK_PATH, log, 'simple_server')
 
 
 def run():
-    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    server.bind((HOST, PORT))
-    server.listen(5)
-    print(f"simple_server listening on {HOST}:{PORT}")
     try:
-        while True:
-            conn, addr = server.accept()
-            t = threading.Thread(target=handle_conn, args=(conn, addr), daemon=True)
-            t.start()
+        asyncio.run(serve())
     except KeyboardInterrupt:
-        print('shutting down')
-    finally:
-        server.close()
+        log.info('shutting down')
+
 
 if __name__ == '__main__':
     run()
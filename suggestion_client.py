@@ -1,8 +1,120 @@
 import socket
-import json
+import struct
+import threading
+
+from suggestion_protocol import json_dumps, json_loads, default_socket_path, is_own_socket
 
 DEFAULT_HOST = "127.0.0.1"
 DEFAULT_PORT = 9999
+# Tried first where AF_UNIX exists; TCP is the fallback (and the only option on Windows)
+DEFAULT_SOCKET_PATH = default_socket_path() if hasattr(socket, "AF_UNIX") else None
+
+# One persistent connection per thread; requests are framed with a 4-byte
+# big-endian length prefix so the same socket can be reused for every keystroke.
+_local = threading.local()
+
+
+def _recvall(sock, n):
+    """Read exactly n bytes from sock, raising ConnectionError if the peer closes early."""
+    # recv_into a preallocated buffer: no per-chunk bytes objects or concatenation
+    buf = bytearray(n)
+    view = memoryview(buf)
+    got = 0
+    while got < n:
+        r = sock.recv_into(view[got:], n - got)
+        if not r:
+            raise ConnectionError("connection closed by suggestion server")
+        got += r
+    return buf
+
+
+def _connect_unix(timeout):
+    """Connect to the server's Unix socket, or return None if that isn't possible here."""
+    # anyone can create files under a shared path, so only trust a socket we own
+    if DEFAULT_SOCKET_PATH is None or not is_own_socket(DEFAULT_SOCKET_PATH):
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(DEFAULT_SOCKET_PATH)
+    except OSError:
+        sock.close()
+        return None
+    return sock
+
+
+def _get_conn(timeout):
+    """Return this thread's connection to the server, connecting lazily."""
+    sock = getattr(_local, "sock", None)
+    if sock is None:
+        sock = _connect_unix(timeout)
+        if sock is None:
+            sock = socket.create_connection((DEFAULT_HOST, DEFAULT_PORT), timeout=timeout)
+            # requests are tiny; don't let Nagle hold them back waiting for an ACK
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        _local.sock = sock
+    sock.settimeout(timeout)
+    return sock
+
+
+def _close_conn():
+    sock = getattr(_local, "sock", None)
+    _local.sock = None
+    if sock is not None:
+        try:
+            sock.close()
+        except OSError:
+            pass
+
+
+def _exchange(bodies, timeout):
+    """Send framed requests back-to-back on the persistent connection and read the replies in order."""
+    sock = _get_conn(timeout)
+    sock.sendall(b"".join(struct.pack(">I", len(body)) + body for body in bodies))
+    replies = []
+    for _ in bodies:
+        (n,) = struct.unpack(">I", _recvall(sock, 4))
+        replies.append(_recvall(sock, n))
+    return replies
+
+
+def _roundtrip(bodies, timeout):
+    """Exchange bodies with the server, returning the reply bodies or None on failure."""
+    # A reused connection may have been closed by the server; reconnect once before giving up.
+    for _ in range(2):
+        try:
+            return _exchange(bodies, timeout)
+        except socket.timeout:
+            # a late reply would desync the stream, so drop the connection
+            _close_conn()
+            return None
+        except OSError:
+            _close_conn()
+    return None
+
+
+def _encode_request(command, model):
+    payload = {"cmd": command}
+    if model:
+        payload["model"] = model
+    return json_dumps(payload)
+
+
+def _parse_suggestions(data):
+    if not data:
+        return []
+    try:
+        obj = json_loads(data)
+        # server may return {"model":..., "suggestions":[...]}
+        if isinstance(obj, dict) and "suggestions" in obj:
+            return obj.get("suggestions", [])
+        # or it might return a list directly
+        if isinstance(obj, list):
+            return obj
+        return []
+    except Exception:
+        return []
 
 
 def get_suggestions(command, model=None, timeout=0.5):
@@ -10,39 +122,20 @@ def get_suggestions(command, model=None, timeout=0.5):
 
     Returns list of suggestion dicts (source, suggestion, confidence, reason) or [] on error.
     """
-    try:
-        client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        client.settimeout(timeout)
-        client.connect((DEFAULT_HOST, DEFAULT_PORT))
-        payload = {"cmd": command}
-        if model:
-            payload["model"] = model
-        client.sendall((json.dumps(payload) + "\n").encode())
-
-        data = b""
-        while True:
-            try:
-                chunk = client.recv(4096)
-            except socket.timeout:
-                break
-            if not chunk:
-                break
-            data += chunk
-            if b"\n" in data:
-                break
-        client.close()
-        if not data:
-            return []
-        try:
-            obj = json.loads(data.decode().strip())
-            # server may return {"model":..., "suggestions":[...]}
-            if isinstance(obj, dict) and "suggestions" in obj:
-                return obj.get("suggestions", [])
-            # or it might return a list directly
-            if isinstance(obj, list):
-                return obj
-            return []
-        except Exception:
-            return []
-    except Exception:
+    replies = _roundtrip([_encode_request(command, model)], timeout)
+    if not replies:
+        return []
+    return _parse_suggestions(replies[0])
+
+
+def get_suggestions_batch(commands, model=None, timeout=0.5):
+    """Pipeline several requests over the persistent connection in one round trip.
+
+    Returns one list of suggestion dicts per command, in order; all are [] on error.
+    """
+    if not commands:
         return []
+    replies = _roundtrip([_encode_request(c, model) for c in commands], timeout)
+    if not replies:
+        return [[] for _ in commands]
+    return [_parse_suggestions(data) for data in replies]
@@ -0,0 +1,195 @@
+"""Helpers shared by the suggestion servers and their clients (standard library only)."""
+import asyncio
+import json
+import os
+import socket
+import stat
+import struct
+
+try:
+    from orjson import dumps as json_dumps, loads as json_loads
+except ImportError:  # orjson is optional; fall back to the standard library
+    def json_dumps(obj):
+        return json.dumps(obj).encode()
+    json_loads = json.loads
+
+
+def default_socket_path():
+    """$SUGGEST_SOCKET_PATH, else a socket in a directory only this user can reach."""
+    path = os.environ.get("SUGGEST_SOCKET_PATH")
+    if path:
+        return path
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime_dir:
+        return os.path.join(runtime_dir, "shell_suggest.sock")
+    # same fallback as core.c; the directory is created 0700 by the server
+    return f"/tmp/shell_suggest-{os.getuid()}/shell_suggest.sock"
+
+
+def is_own_socket(path):
+    """True if path is a Unix socket owned by this user, so keystrokes can safely go there."""
+    try:
+        st = os.lstat(path)
+    except OSError:
+        return False
+    return stat.S_ISSOCK(st.st_mode) and st.st_uid == os.getuid()
+
+
+# ---------------------------------------------------------------------------
+# Server side: one asyncio connection loop and listener setup for both servers
+# ---------------------------------------------------------------------------
+
+# Requests are framed with a 4-byte big-endian length prefix. Payloads are small, so the
+# first byte of a framed request is always 0; anything else is a legacy newline-terminated
+# client (core.c), answered once in kind.
+FRAME = struct.Struct(">I")
+# How long a legacy client gets to finish its line; after that whatever arrived is answered
+LEGACY_TIMEOUT = 1.0
+# SUGGEST_REUSEPORT=1 lets several server processes share the TCP port on purpose; off by
+# default so a second server (or the mock next to the real one) fails with EADDRINUSE
+REUSE_PORT = os.environ.get("SUGGEST_REUSEPORT") == "1" and hasattr(socket, "SO_REUSEPORT")
+# Handler task -> writer for each open connection. Shutdown closes these so the handlers
+# return on their own instead of being cancelled mid-read.
+_CONNECTIONS = {}
+
+
+async def _read_legacy_request(reader, first):
+    """Read one newline-terminated request, settling for what arrived by EOF or the timeout."""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + LEGACY_TIMEOUT
+    data = bytearray(first)
+    while b"\n" not in data:
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            break
+        try:
+            chunk = await asyncio.wait_for(reader.read(4096), remaining)
+        except asyncio.TimeoutError:
+            break
+        if not chunk:
+            break
+        data += chunk
+    return bytes(data).split(b"\n", 1)[0]
+
+
+async def serve_connection(reader, writer, answer, log):
+    """Serve requests from one client until it disconnects.
+
+    answer is a coroutine function taking the request text and returning the
+    encoded JSON reply body.
+    """
+    sock = writer.get_extra_info("socket")
+    if sock is not None and sock.family in (socket.AF_INET, socket.AF_INET6):
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    framed = True
+    _CONNECTIONS[asyncio.current_task()] = writer
+    try:
+        while True:
+            first = await reader.read(1)
+            if not first:
+                break
+
+            if first != b"\x00":
+                framed = False
+                data = await _read_legacy_request(reader, first)
+                writer.write(await answer(data.decode().strip()) + b"\n")
+                await writer.drain()
+                break
+
+            (n,) = FRAME.unpack(first + await reader.readexactly(3))
+            data = await reader.readexactly(n)
+            body = await answer(data.decode().strip())
+            writer.write(FRAME.pack(len(body)) + body)
+            await writer.drain()
+
+    except (asyncio.IncompleteReadError, ConnectionError):
+        # client went away mid-request
+        pass
+    except Exception as e:
+        log.warning("Error handling connection: %s", e)
+        try:
+            error_resp = json_dumps({"error": str(e)})
+            writer.write(FRAME.pack(len(error_resp)) + error_resp if framed else error_resp + b"\n")
+            await writer.drain()
+        except Exception:
+            pass
+    finally:
+        _CONNECTIONS.pop(asyncio.current_task(), None)
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except Exception:
+            pass
+
+
+def _claim_socket_path(path, log):
+    """Get path ready to bind, or return False if it belongs to someone else.
+
+    A socket left behind by a crashed run (one that refuses connections) is
+    removed; a live one means another server process is already serving it.
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        st = os.lstat(directory)
+        if st.st_uid != os.getuid() or st.st_mode & 0o077:
+            log.warning("Not listening on %s: %s is not private to this user", path, directory)
+            return False
+    try:
+        st = os.lstat(path)
+    except FileNotFoundError:
+        return True
+    if not stat.S_ISSOCK(st.st_mode) or st.st_uid != os.getuid():
+        log.warning("Not listening on %s: the path exists and is not our socket", path)
+        return False
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+    except ConnectionRefusedError:
+        os.unlink(path)
+        return True
+    except OSError as e:
+        log.warning("Not listening on %s: %s", path, e)
+        return False
+    finally:
+        probe.close()
+    log.info("%s is already served by another process", path)
+    return False
+
+
+def _release_socket_path(path, bound):
+    """Remove path only if it is still the socket this process bound"""
+    try:
+        st = os.lstat(path)
+    except FileNotFoundError:
+        return
+    if (st.st_dev, st.st_ino) == bound:
+        os.unlink(path)
+
+
+async def serve_forever(handle_client, host, port, sock_path, log, name):
+    """Listen on host:port (and on sock_path where AF_UNIX exists) until cancelled."""
+    server = await asyncio.start_server(
+        handle_client, host, port,
+        # the kernel balances accepts between the processes sharing the port
+        reuse_port=REUSE_PORT,
+    )
+    servers = [server]
+    log.info("%s listening on %s:%d", name, host, port)
+    bound = None
+    if sock_path and _claim_socket_path(sock_path, log):
+        servers.append(await asyncio.start_unix_server(handle_client, sock_path))
+        st = os.lstat(sock_path)
+        bound = (st.st_dev, st.st_ino)
+        log.info("%s listening on %s", name, sock_path)
+    try:
+        await asyncio.gather(*(s.serve_forever() for s in servers))
+    finally:
+        for s in servers:
+            s.close()
+        for writer in list(_CONNECTIONS.values()):
+            writer.close()
+        if _CONNECTIONS:
+            await asyncio.wait(list(_CONNECTIONS), timeout=LEGACY_TIMEOUT)
+        if bound is not None:
+            _release_socket_path(sock_path, bound)
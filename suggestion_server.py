@@ -1,13 +1,29 @@
 #!/usr/bin/env python3
-import socket, os, json, threading, joblib
+import socket, os, re, json, asyncio, joblib, bisect, functools
+from concurrent.futures import ThreadPoolExecutor
+from itertools import accumulate
 from rapidfuzz import process, fuzz
-from sklearn.metrics.pairwise import cosine_similarity
+from sklearn.preprocessing import normalize
+from scipy import sparse
 import numpy as np
-import traceback
+import logging
 
-# Use TCP instead of Unix sockets for Windows compatibility
+from suggestion_protocol import json_dumps, json_loads, default_socket_path, serve_connection, serve_forever
+
+# Per-request detail is logged at DEBUG so the hot path does no formatting or I/O by default;
+# set SUGGEST_LOG_LEVEL=DEBUG to trace each query
+logging.basicConfig(level=os.environ.get("SUGGEST_LOG_LEVEL", "INFO").upper(), format="%(message)s")
+log = logging.getLogger("suggest")
+
+# TCP works everywhere (Windows included); where AF_UNIX exists the server also listens on
+# SOCK_PATH, which skips the TCP/IP stack. The default path is the one core.c tries first.
 HOST = "localhost"
 PORT = 9999
+SOCK_PATH = default_socket_path() if hasattr(socket, "AF_UNIX") else None
+# Threads that run the CPU-bound ranking off the event loop; more threads than cores
+# would only queue on the GIL and the BLAS/sparse kernels
+MAX_WORKERS = os.cpu_count() or 4
+EXECUTOR = ThreadPoolExecutor(max_workers=MAX_WORKERS)
 
 MODELS_DIR = "models"
 
@@ -17,25 +33,59 @@ DEFAULT_MODEL = os.environ.get("SUGGEST_DEFAULT_MODEL", "Claude Haiku 4.5")
 def load_models():
     """Load models with error handling"""
     try:
-        vectorizer = joblib.load(f"{MODELS_DIR}/tfidf_vectorizer.pkl")
+        # Arrays inside the pickle are backed by the page cache and shared between server processes
+        vectorizer = joblib.load(f"{MODELS_DIR}/tfidf_vectorizer.pkl", mmap_mode="r")
         commands_list = joblib.load(f"{MODELS_DIR}/commands_list.pkl")
-        markov = joblib.load(f"{MODELS_DIR}/markov_model.pkl")
         with open(f"{MODELS_DIR}/known_cmds.json", "r", encoding="utf8") as f:
             known_cmds = json.load(f)
 
-        print(f"Loaded {len(commands_list)} commands, {len(known_cmds)} known commands")
-        print(f"Sample commands: {commands_list[:5]}")  
-        return vectorizer, commands_list, markov, known_cmds
+        log.info("Loaded %d commands, %d known commands", len(commands_list), len(known_cmds))
+        log.info("Sample commands: %s", commands_list[:5])
+        return vectorizer, commands_list, known_cmds
 
     except Exception as e:
-        print(f"Error loading models: {e}")
-        print(traceback.format_exc())
+        log.exception("Error loading models: %s", e)
         from sklearn.feature_extraction.text import TfidfVectorizer
         vectorizer = TfidfVectorizer()
         vectorizer.fit([""])
-        return vectorizer, [], {}, []
+        return vectorizer, [], []
+
+def load_csr(name):
+    """Memory-map a CSR matrix saved by train_from_csv.py as {name}_*.npy, or None if absent"""
+    try:
+        data, indices, indptr, shape = (
+            np.load(f"{MODELS_DIR}/{name}_{part}.npy", mmap_mode="r")
+            for part in ("data", "indices", "indptr", "shape")
+        )
+    except (OSError, ValueError):
+        return None
+    # csr_matrix keeps the memory-mapped arrays as-is: pages load on demand and are shared
+    return sparse.csr_matrix((data, indices, indptr), shape=tuple(int(n) for n in shape), copy=False)
+
+def markov_from_dict(markov):
+    """Convert a {prev: {next: count}} markov_model.pkl from older training runs into (vocab, transition counts)"""
+    index, rows, cols, counts = {}, [], [], []
+    for prev, nxts in markov.items():
+        for nxt, count in nxts.items():
+            rows.append(index.setdefault(prev, len(index)))
+            cols.append(index.setdefault(nxt, len(index)))
+            counts.append(count)
+    n = len(index)
+    return list(index), sparse.csr_matrix((counts, (rows, cols)), shape=(n, n), dtype=np.int32)
+
+def load_markov():
+    """Load the Markov model as (vocab, CSR matrix of transition counts)"""
+    try:
+        matrix = load_csr("markov")
+        if matrix is not None:
+            return joblib.load(f"{MODELS_DIR}/markov_vocab.pkl"), matrix
+        return markov_from_dict(joblib.load(f"{MODELS_DIR}/markov_model.pkl"))
+    except Exception as e:
+        log.exception("Error loading Markov model: %s", e)
+        return [], sparse.csr_matrix((0, 0), dtype=np.int32)
 
-vectorizer, commands_list, markov, known_cmds = load_models()
+vectorizer, commands_list, known_cmds = load_models()
+n_trained = len(commands_list)
 
 # -------------------------------------------
 # ADDING EXTRA COMMANDS HERE
@@ -71,21 +121,110 @@ for cmd in extra_commands:
     if cmd not in known_cmds:
         known_cmds.append(cmd)
 
-print(f"Added {len(extra_commands)} extra commands.")
-print(f"Total commands: {len(commands_list)} | Total known commands: {len(known_cmds)}")
+log.info("Added %d extra commands.", len(extra_commands))
+log.info("Total commands: %d | Total known commands: %d", len(commands_list), len(known_cmds))
+
+# L2-normalized terms x commands matrices: the trained catalog (memory-mapped) and the extras
+CORPUS_T = load_csr("corpus_t")
+if CORPUS_T is None or CORPUS_T.shape != (len(vectorizer.vocabulary_), n_trained):
+    CORPUS_T = normalize(vectorizer.transform(commands_list[:n_trained]), norm="l2", copy=False).T.tocsr()
+if len(commands_list) > n_trained:
+    EXTRA_T = normalize(vectorizer.transform(commands_list[n_trained:]), norm="l2", copy=False).T.tocsr()
+else:
+    EXTRA_T = sparse.csr_matrix((len(vectorizer.vocabulary_), 0), dtype=np.float32)
+# Match the float32 query rows so the mat-vec never upcasts
+CORPUS_T = CORPUS_T.astype(np.float32, copy=False)
+EXTRA_T = EXTRA_T.astype(np.float32, copy=False)
+
+def build_prefix_index(cmds):
+    """Sort commands by lowercase form so all completions of a prefix form one contiguous run"""
+    pairs = sorted((c.lower(), c) for c in set(cmds))
+    return [low for low, _ in pairs], [c for _, c in pairs]
+
+PREFIX_KEYS, PREFIX_CMDS = build_prefix_index(known_cmds)
+# Parallel to known_cmds, so the partial-match fallback doesn't lowercase per query
+KNOWN_CMDS_LOWER = [c.lower() for c in known_cmds]
+KNOWN_CMDS_TUPLE = tuple(known_cmds)
+# typo_fix scores against these, so rapidfuzz never calls back into Python per candidate
+KNOWN_CMDS_LOWER_TUPLE = tuple(KNOWN_CMDS_LOWER)
+# rapidfuzz threads for typo_fix; spreading one query over all cores only pays off
+# once the catalog is large enough to outweigh the thread start-up
+TYPO_WORKERS = -1 if len(KNOWN_CMDS_TUPLE) >= 10000 else 1
+
+# All lowercased commands in one string, so a substring search is one C-level scan
+# rather than N `in` tests; LINE_STARTS maps a match offset back to its command
+KNOWN_JOINED = "\n".join(KNOWN_CMDS_LOWER)
+LINE_STARTS = [0, *accumulate(len(low) + 1 for low in KNOWN_CMDS_LOWER[:-1])]
+
+# Row i of MARKOV holds the successor counts of MARKOV_VOCAB[i]
+MARKOV_VOCAB, MARKOV = load_markov()
+MARKOV_INDEX = {cmd: i for i, cmd in enumerate(MARKOV_VOCAB)}
+MARKOV_TOTALS = np.asarray(MARKOV.sum(axis=1)).ravel()
+
+@functools.lru_cache(maxsize=None)
+def markov_top3(i):
+    """Top 3 successors of MARKOV_VOCAB[i] with confidence above 0.05, ranked once per row"""
+    start, end = MARKOV.indptr[i], MARKOV.indptr[i + 1]
+    counts, nxts = MARKOV.data[start:end], MARKOV.indices[start:end]
+    k = min(3, counts.size)
+    if k == 0:
+        return ()
+    top = np.argpartition(-counts, k - 1)[:k]
+    top = top[np.argsort(-counts[top], kind="stable")]
+    total = float(MARKOV_TOTALS[i])
+    return tuple((MARKOV_VOCAB[nxts[j]], float(counts[j]) / total) for j in top
+                 if float(counts[j]) / total > 0.05)
 # -------------------------------------------
 
+def prefix_matches(q, k=5):
+    """Return up to k known commands that start with q (case-insensitive)"""
+    ql = q.lower()
+    i = bisect.bisect_left(PREFIX_KEYS, ql)
+    results = []
+    while i < len(PREFIX_KEYS) and len(results) < k and PREFIX_KEYS[i].startswith(ql):
+        if PREFIX_KEYS[i] != ql:
+            results.append(PREFIX_CMDS[i])
+        i += 1
+    return results
+
+def partial_matches(ql, k=3):
+    """Return up to k known commands containing the lowercased query ql (other than ql itself)"""
+    results = []
+    if not ql or "\n" in ql:
+        return results
+    # a literal pattern lets the regex engine use its fast literal scan over the whole corpus
+    pat = re.compile(re.escape(ql))
+    m = pat.search(KNOWN_JOINED)
+    while m and len(results) < k:
+        i = bisect.bisect_right(LINE_STARTS, m.start()) - 1
+        if KNOWN_CMDS_LOWER[i] != ql:
+            results.append(known_cmds[i])
+        # one hit per command is enough; resume at the next one
+        if i + 1 == len(LINE_STARTS):
+            break
+        m = pat.search(KNOWN_JOINED, LINE_STARTS[i + 1])
+    return results
+
 def typo_fix(query):
     """Fix typos in PowerShell commands with better matching"""
     if not known_cmds or not query.strip():
         return None, 0.0
 
-    print(f"  TypoFix: searching for '{query}' in {len(known_cmds)} known commands")
+    log.debug("  TypoFix: searching for '%s' in %d known commands", query, len(known_cmds))
 
-    match, score, _ = process.extractOne(query, known_cmds, scorer=fuzz.ratio)
-    normalized_score = float(score) / 100.0
+    # One C++ call scores the whole catalog without holding the GIL; score_cutoff lets
+    # rapidfuzz skip candidates that can't reach 60, and those come back as 0
+    scores = process.cdist([query.lower()], KNOWN_CMDS_LOWER_TUPLE, scorer=fuzz.QRatio,
+                           score_cutoff=60, workers=TYPO_WORKERS)[0]
+    i = int(scores.argmax())
+    if scores[i] < 60:
+        log.debug("  TypoFix: no match above cutoff")
+        return None, 0.0
+
+    match = KNOWN_CMDS_TUPLE[i]
+    normalized_score = float(scores[i]) / 100.0
 
-    print(f"  TypoFix: best match '{match}' with score {normalized_score}")
+    log.debug("  TypoFix: best match '%s' with score %.2f", match, normalized_score)
 
     if normalized_score > 0.60:
         return match, normalized_score
@@ -97,23 +236,10 @@ def predict_next(query):
     if not query.strip():
         return []
 
-    print(f"  NextCmd: checking Markov for '{query}'")
-
-    if query in markov:
-        nxts = markov[query]
-        top_next = sorted(nxts.items(), key=lambda x: x[1], reverse=True)[:3]
-        results = []
-        total = sum(nxts.values())
-
-        for nxt, count in top_next:
-            confidence = float(count) / total
-            if confidence > 0.05:
-                results.append((nxt, confidence))
-
-        print(f"  NextCmd: found {len(results)} next commands")
-        return results
-    print(f"  NextCmd: no Markov transitions for '{query}'")
-    return []
+    i = MARKOV_INDEX.get(query)
+    if i is None:
+        return []
+    return list(markov_top3(i))
 
 def recommend_templates(query, topk=5):
     """Recommend similar PowerShell command templates"""
@@ -121,19 +247,32 @@ def recommend_templates(query, topk=5):
         return []
 
     try:
-        print(f"  Template: finding similar to '{query}'")
+        log.debug("  Template: finding similar to '%s'", query)
         qv = vectorizer.transform([query])
-        sims = cosine_similarity(qv, vectorizer.transform(commands_list)).flatten()
-        idx = sims.argsort()[-topk:][::-1]
+        if qv.nnz == 0:
+            # no query term is in the vocabulary, so every similarity would be zero
+            log.debug("  Template: no known terms")
+            return []
+        qv = normalize(qv).astype(np.float32, copy=False)
+        # 1 x N sparse rows: only commands sharing a term with the query are stored
+        trained, extra = qv @ CORPUS_T, qv @ EXTRA_T
+        scores = np.concatenate((trained.data, extra.data))
+        cols = np.concatenate((trained.indices, extra.indices + n_trained))
+        k = min(topk, scores.size)
         results = []
-        for i in idx:
-            if sims[i] > 0.05:
-                results.append((commands_list[i], float(sims[i])))
-
-        print(f"  Template: found {len(results)} similar commands")
+        if k == 0:
+            log.debug("  Template: no overlapping terms")
+            return results
+        idx = np.argpartition(scores, -k)[-k:]
+        idx = idx[np.argsort(-scores[idx])]
+        for j in idx:
+            if scores[j] > 0.05:
+                results.append((commands_list[cols[j]], float(scores[j])))
+
+        log.debug("  Template: found %d similar commands", len(results))
         return results
     except Exception as e:
-        print(f"Template recommendation error: {e}")
+        log.warning("Template recommendation error: %s", e)
         return []
 
 def rank_and_merge(query):
@@ -141,15 +280,36 @@ def rank_and_merge(query):
     if not query or not query.strip():
         return [{"source": "Info", "suggestion": "Type a command to get suggestions", "confidence": 0.0, "reason": "Empty input"}]
 
-    query = query.strip()
-    print(f"Processing query: '{query}'")
+    return [dict(it) for it in _rank_and_merge_cached(query.strip())]
+
+# The catalog is static for the life of the process, so results never go stale.
+# Queries are only stripped, not lowercased: Markov lookups are case-sensitive.
+@functools.lru_cache(maxsize=4096)
+def _rank_and_merge_cached(query):
+    """Compute suggestions for a stripped query as a tuple of frozen (key, value) items"""
+    log.debug("Processing query: '%s'", query)
 
-    typo_s, typo_conf = typo_fix(query)
+    ql = query.lower()
+    prefix = prefix_matches(query, k=5)
     next_commands = predict_next(query)
-    templ = recommend_templates(query, topk=5)
+
+    # Fuzzy and TF-IDF matching only when plain completion comes up short. A query with
+    # any completion is a prefix being typed, not a typo: a fuzzy guess would only
+    # outrank the real completion, so the catalog-wide rapidfuzz pass is skipped.
+    typo_s, typo_conf = typo_fix(query) if not prefix else (None, 0.0)
+    templ = recommend_templates(query, topk=5) if len(prefix) < 5 else []
 
     items = []
 
+    for cmd in prefix:
+        items.append({
+            "source": "Prefix",
+            "suggestion": cmd,
+            # floored at the typo cutoff: a real completion beats a weak fuzzy/TF-IDF guess
+            "confidence": round(0.6 + 0.4 * len(query) / len(cmd), 2),
+            "reason": f"Completes '{query}'"
+        })
+
     if typo_s and typo_conf > 0.6:
         items.append({
             "source": "TypoFixer",
@@ -168,7 +328,7 @@ def rank_and_merge(query):
             })
 
     for s, c in templ:
-        if s.lower() != query.lower():
+        if s.lower() != ql:
             items.append({
                 "source": "Template",
                 "suggestion": s,
@@ -177,17 +337,14 @@ def rank_and_merge(query):
             })
 
     if not items and len(query) > 1:
-        print(f"  Fallback: searching for partial matches to '{query}'")
-        for cmd in known_cmds:
-            if query.lower() in cmd.lower() and cmd.lower() != query.lower():
-                items.append({
-                    "source": "Partial",
-                    "suggestion": cmd,
-                    "confidence": 0.3,
-                    "reason": f"Contains '{query}'"
-                })
-                if len(items) >= 3:
-                    break
+        log.debug("  Fallback: searching for partial matches to '%s'", query)
+        for cmd in partial_matches(ql, k=3):
+            items.append({
+                "source": "Partial",
+                "suggestion": cmd,
+                "confidence": 0.3,
+                "reason": f"Contains '{query}'"
+            })
 
     seen = {}
     for it in items:
@@ -197,78 +354,48 @@ def rank_and_merge(query):
 
     merged = sorted(seen.values(), key=lambda x: x["confidence"], reverse=True)
     result = merged[:5]
-    print(f"  Final: returning {len(result)} suggestions")
-    return result
+    log.debug("  Final: returning %d suggestions", len(result))
+    return tuple(tuple(it.items()) for it in result)
 
-def handle_conn(conn):
+def handle_request(raw):
+    """Answer one request payload and return the encoded JSON response body."""
+    log.debug("Received: %s", raw)
+
+    query = raw
+    model_req = None
     try:
-        data = b""
-        conn.settimeout(1.0)
-        try:
-            while True:
-                chunk = conn.recv(4096)
-                if not chunk:
-                    break
-                data += chunk
-                if b"\n" in data:
-                    break
-        except socket.timeout:
-            pass
-
-        if not data:
-            conn.close()
-            return
-
-        raw = data.decode().strip()
-        print(f"Received: {raw}")
-
-        query = raw
-        model_req = None
-        try:
-            obj = json.loads(raw)
-            if isinstance(obj, dict):
-                query = obj.get("cmd", "")
-                model_req = obj.get("model")
-        except Exception:
-            pass
-
-        model_used = model_req if model_req else DEFAULT_MODEL
-        resp = rank_and_merge(query)
-
-        response_payload = {"model": model_used, "suggestions": resp}
-        response_data = (json.dumps(response_payload) + "\n").encode()
-        conn.sendall(response_data)
+        obj = json_loads(raw)
+        if isinstance(obj, dict):
+            query = obj.get("cmd", "")
+            model_req = obj.get("model")
+    except Exception:
+        pass
 
-    except Exception as e:
-        print(f"Error handling connection: {e}")
-        try:
-            error_resp = json.dumps({"error": str(e)}) + "\n"
-            conn.sendall(error_resp.encode())
-        except:
-            pass
-    finally:
-        try:
-            conn.close()
-        except:
-            pass
+    model_used = model_req if model_req else DEFAULT_MODEL
+    resp = rank_and_merge(query)
+
+    response_payload = {"model": model_used, "suggestions": resp}
+    return json_dumps(response_payload)
+
+async def answer(raw):
+    """Rank on EXECUTOR so the event loop keeps serving other clients"""
+    return await asyncio.get_running_loop().run_in_executor(EXECUTOR, handle_request, raw)
+
+async def handle_client(reader, writer):
+    """Serve framed (or legacy newline-terminated) requests from one client"""
+    await serve_connection(reader, writer, answer, log)
+
+async def serve():
+    log.info("Default model: %s", DEFAULT_MODEL)
+    await serve_forever(handle_client, HOST, PORT, SOCK_PATH, log, "Suggestion server")
 
 def run_server():
-    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    server.bind((HOST, PORT))
-    server.listen(5)
-    print(f"Suggestion server listening on {HOST}:{PORT} (default model: {DEFAULT_MODEL})")
     try:
-        while True:
-            conn, addr = server.accept()
-            print(f"Connection from {addr}")
-            t = threading.Thread(target=handle_conn, args=(conn,))
-            t.daemon = True
-            t.start()
+        asyncio.run(serve())
     except KeyboardInterrupt:
-        print("Shutting down server...")
+        log.info("Shutting down server...")
     finally:
-        server.close()
+        EXECUTOR.shutdown(wait=False)
 
 if __name__ == "__main__":
     run_server()
@@ -1,31 +1,16 @@
-import socket
-import json
 from prompt_toolkit import prompt
 from prompt_toolkit.completion import Completer, Completion
 
+from suggestion_client import get_suggestions
+
 class SuggestionCompleter(Completer):
     def get_completions(self, document, complete_event):
         command = document.text.strip()
         if not command:
             return
 
-        # send to suggestion server
-        try:
-            client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            client.connect(("localhost", 8888))
-            client.sendall((json.dumps({"cmd": command}) + "\n").encode())
-            response = b""
-            while True:
-                chunk = client.recv(4096)
-                if not chunk:
-                    break
-                response += chunk
-                if b"\n" in response:
-                    break
-            client.close()
-            suggestions = json.loads(response.decode().strip())
-        except Exception:
-            suggestions = []
+        # suggestion_client keeps one framed connection open and reconnects if it drops
+        suggestions = get_suggestions(command)
 
         # show suggestion completions below the input
         for suggestion in suggestions:
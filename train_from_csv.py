@@ -2,10 +2,11 @@
 import pandas as pd
 from rapidfuzz import process, fuzz
 from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
+from sklearn.preprocessing import normalize
+import numpy as np
 import joblib
 import json
-from collections import defaultdict, Counter
+from scipy import sparse
 import argparse
 import os
 
@@ -13,6 +14,8 @@ parser = argparse.ArgumentParser()
 parser.add_argument("--input", default="powershell_commands.csv", help="CSV or XLSX file with commands")
 parser.add_argument("--col", default=None, help="column name that contains commands (optional)")
 parser.add_argument("--outdir", default="models", help="folder to save models")
+parser.add_argument("--min-df", type=int, default=1,
+                    help="drop TF-IDF terms found in fewer commands (2+ shrinks large corpora)")
 args = parser.parse_args()
 
 os.makedirs(args.outdir, exist_ok=True)
@@ -32,8 +35,7 @@ else:
 
 commands = df[cmd_col].astype(str).dropna().tolist()
 # Optionally dedupe while preserving order
-seen = set()
-commands = [c for c in commands if not (c in seen or seen.add(c))]
+commands = list(dict.fromkeys(commands))
 
 print(f"Loaded {len(commands)} commands from '{cmd_col}'")
 
@@ -44,23 +46,42 @@ known_cmds = commands.copy()
 with open(f"{args.outdir}/known_cmds.json", "w", encoding="utf8") as f:
     json.dump(known_cmds, f, indent=2, ensure_ascii=False)
 
-# 3) Next command predictor (Markov / 1-gram transitions)
-transitions = defaultdict(Counter)
-for i in range(len(commands) - 1):
-    transitions[commands[i]][commands[i+1]] += 1
+def save_csr(name, M):
+    """Save a CSR matrix as raw .npy arrays the server can memory-map"""
+    for part, arr in (("data", M.data), ("indices", M.indices), ("indptr", M.indptr), ("shape", np.array(M.shape))):
+        np.save(f"{args.outdir}/{name}_{part}.npy", arr)
 
-# Convert to regular dict for saving
-transitions_dict = {k: dict(v) for k, v in transitions.items()}
-joblib.dump(transitions_dict, f"{args.outdir}/markov_model.pkl")
-print("Saved markov_model.pkl")
+# 3) Next command predictor (Markov / 1-gram transitions)
+# Row i of the matrix counts the commands that followed vocab[i]; COO->CSR sums repeated pairs
+vocab = sorted(set(commands))
+index = {cmd: i for i, cmd in enumerate(vocab)}
+ids = np.fromiter((index[c] for c in commands), dtype=np.int32, count=len(commands))
+transitions = sparse.csr_matrix(
+    (np.ones(max(len(ids) - 1, 0), dtype=np.int32), (ids[:-1], ids[1:])),
+    shape=(len(vocab), len(vocab)),
+)
+save_csr("markov", transitions)
+joblib.dump(vocab, f"{args.outdir}/markov_vocab.pkl")
+print("Saved markov_{data,indices,indptr,shape}.npy and markov_vocab.pkl")
 
-# 4) TF-IDF for flag/template recommender
-vectorizer = TfidfVectorizer()
+# 4) TF-IDF for flag/template recommender (float32; flags like -la stay whole, get-process splits)
+vectorizer = TfidfVectorizer(
+    token_pattern=r"(?u)(?<!\S)--?\w+|\w+",
+    lowercase=True,
+    sublinear_tf=True,
+    min_df=args.min_df,
+    dtype=np.float32,
+)
 X = vectorizer.fit_transform(commands)
-joblib.dump(vectorizer, f"{args.outdir}/tfidf_vectorizer.pkl")
+# Uncompressed, so the server can memory-map the idf array instead of copying it into the heap
+joblib.dump(vectorizer, f"{args.outdir}/tfidf_vectorizer.pkl", compress=0)
 joblib.dump(commands, f"{args.outdir}/commands_list.pkl")  # save the corpus
 print("Saved tfidf_vectorizer.pkl and commands_list.pkl")
 
+# Save the L2-normalized corpus as terms x commands CSR arrays for the server to memory-map
+save_csr("corpus_t", normalize(X, norm="l2", copy=False).T.tocsr())
+print("Saved corpus_t_{data,indices,indptr,shape}.npy")
+
 # 5) Quick test function printout
 print("\nQuick tests (examples):")
 sample = commands[0] if commands else "ls -la"